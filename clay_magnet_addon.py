@@ -15,11 +15,142 @@ bl_info = {
 
 import bpy
 import mathutils
-import bpy_extras
 import math
-
-# Store tagged bones globally (per armature)
-tagged_bones = {}
+import numpy as np
+from bpy.app.handlers import persistent
+
+# Numba is optional, Blender doesn't ship it. Without it we stick to plain NumPy.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Flip on to get chatty console output while debugging
+DEBUG = False
+
+# Local-space centroid of each custom shape, keyed by (object name, vertex count)
+_custom_shape_centroid_cache = {}
+
+def _custom_shape_centroid(mesh):
+    key = (mesh.name, len(mesh.data.vertices))
+    centroid = _custom_shape_centroid_cache.get(key)
+    if centroid is None:
+        # One bulk read of all coordinates instead of a Vector per vertex
+        buf = np.empty(key[1] * 3, dtype=np.float32)
+        mesh.data.vertices.foreach_get("co", buf)
+        centroid = mathutils.Vector(buf.reshape(key[1], 3).mean(axis=0))
+        _custom_shape_centroid_cache[key] = centroid
+    return centroid
+
+# Tags live on the bones themselves (Bone.clay_magnet_tag), read them all in one go
+def _tag_mask(armature):
+    bones = armature.data.bones
+    mask = np.empty(len(bones), dtype=bool)
+    bones.foreach_get("clay_magnet_tag", mask)
+    return mask
+
+# Last projected screen position of each tagged bone, keyed by armature.as_pointer()
+_last_screen_pos = {}
+
+# Same math as view3d_utils.location_3d_to_region_2d, for many points at once
+def _project_points_numpy(centers, persp, half):
+    points = np.ones((len(centers), 4), dtype=np.float32)
+    points[:, :3] = centers
+    clip = points @ persp.T
+    visible = clip[:, 3] > 0.0
+    ndc = clip[:, :2] / np.where(visible, clip[:, 3], 1.0)[:, None]
+    return half + half * ndc, visible
+
+# Nearest visible point within the hitbox, or -1
+def _closest_hit_numpy(screen_pos, visible, mouse_x, mouse_y, hitbox_sq):
+    dx = screen_pos[:, 0] - mouse_x
+    dy = screen_pos[:, 1] - mouse_y
+    dist_sq = np.where(visible, dx * dx + dy * dy, np.inf)
+    closest = int(np.argmin(dist_sq))
+    return closest if dist_sq[closest] < hitbox_sq else -1
+
+if njit is not None:
+    # Compiled loop versions of the two helpers above. Explicit signatures make numba
+    # compile them (or load them from its disk cache) at import, not on the first F press.
+    @njit("Tuple((f4[:, ::1], b1[::1]))(f4[:, ::1], f4[:, ::1], f4[::1])", cache=True)
+    def _project_points(centers, persp, half):
+        count = centers.shape[0]
+        screen_pos = np.zeros((count, 2), dtype=np.float32)
+        visible = np.zeros(count, dtype=np.bool_)
+        for i in range(count):
+            x, y, z = centers[i, 0], centers[i, 1], centers[i, 2]
+            w = persp[3, 0] * x + persp[3, 1] * y + persp[3, 2] * z + persp[3, 3]
+            if w > 0.0:
+                px = persp[0, 0] * x + persp[0, 1] * y + persp[0, 2] * z + persp[0, 3]
+                py = persp[1, 0] * x + persp[1, 1] * y + persp[1, 2] * z + persp[1, 3]
+                screen_pos[i, 0] = half[0] + half[0] * px / w
+                screen_pos[i, 1] = half[1] + half[1] * py / w
+                visible[i] = True
+        return screen_pos, visible
+
+    @njit("i8(f4[:, ::1], b1[::1], f8, f8, f8)", cache=True)
+    def _closest_hit(screen_pos, visible, mouse_x, mouse_y, hitbox_sq):
+        closest = -1
+        closest_sq = hitbox_sq
+        for i in range(screen_pos.shape[0]):
+            if visible[i]:
+                dx = screen_pos[i, 0] - mouse_x
+                dy = screen_pos[i, 1] - mouse_y
+                dist_sq = dx * dx + dy * dy
+                if dist_sq < closest_sq:
+                    closest_sq = dist_sq
+                    closest = i
+        return closest
+else:
+    _project_points = _project_points_numpy
+    _closest_hit = _closest_hit_numpy
+
+def _project_to_region(region, rv3d, centers):
+    persp = np.array(rv3d.perspective_matrix, dtype=np.float32)
+    half = np.array((region.width / 2.0, region.height / 2.0), dtype=np.float32)
+    return _project_points(np.ascontiguousarray(centers, dtype=np.float32), persp, half)
+
+# Object count seen by the last depsgraph update, to notice deletions cheaply
+_last_object_count = 0
+
+# Forget per-armature cache entries whose armature object no longer exists
+def _prune_armature_caches():
+    alive = {obj.as_pointer() for obj in bpy.data.objects if obj.type == 'ARMATURE'}
+    for key in [key for key in _last_screen_pos if key not in alive]:
+        del _last_screen_pos[key]
+
+# Drop cached centroids when a custom shape gets edited, and screen positions
+# whenever anything moves
+@persistent
+def _on_depsgraph_update(scene, depsgraph):
+    global _last_object_count
+    object_count = len(bpy.data.objects)
+    if object_count != _last_object_count:
+        _last_object_count = object_count
+        _prune_armature_caches()
+
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Mesh):
+            _custom_shape_centroid_cache.clear()
+        elif isinstance(update.id, bpy.types.Object):
+            if update.is_updated_geometry or update.is_updated_transform:
+                _last_screen_pos.clear()
+            if update.is_updated_geometry:
+                name = update.id.original.name
+                for key in [key for key in _custom_shape_centroid_cache if key[0] == name]:
+                    del _custom_shape_centroid_cache[key]
+
+# Undo, redo and file loads swap the data out from under us, start from scratch
+@persistent
+def _on_data_reload(*args):
+    _custom_shape_centroid_cache.clear()
+    _last_screen_pos.clear()
+
+_RELOAD_HANDLERS = (
+    bpy.app.handlers.undo_post,
+    bpy.app.handlers.redo_post,
+    bpy.app.handlers.load_post,
+)
 
 class CLAYMAGNET_Preferences(bpy.types.AddonPreferences):
     bl_idname = __name__
@@ -56,12 +187,10 @@ class CLAYMAGNET_OT_tag_bone(bpy.types.Operator):
             self.report({'ERROR'}, "Select an armature first!")
             return {'CANCELLED'}
 
-        if armature not in tagged_bones:
-            tagged_bones[armature] = set()
-
         for bone in context.selected_pose_bones or []:
-            tagged_bones[armature].add(bone.name)
-            print(f"Tagged {bone.name} for {armature.name}")  # Debug cheer
+            bone.bone.clay_magnet_tag = True
+            if DEBUG:
+                print(f"Tagged {bone.name} for {armature.name}")  # Debug cheer
 
         return {'FINISHED'}
 
@@ -78,9 +207,9 @@ class CLAYMAGNET_OT_untag_bone(bpy.types.Operator):
             self.report({'ERROR'}, "Need an armature, buddy!")
             return {'CANCELLED'}
 
-        if armature in tagged_bones:
-            for bone in context.selected_pose_bones or []:
-                tagged_bones[armature].discard(bone.name)
+        for bone in context.selected_pose_bones or []:
+            bone.bone.clay_magnet_tag = False
+            if DEBUG:
                 print(f"Untagged {bone.name} from {armature.name}")  # Bye tag!
 
         return {'FINISHED'}
@@ -98,9 +227,12 @@ class CLAYMAGNET_OT_find_tagged(bpy.types.Operator):
             self.report({'ERROR'}, "Pick an armature first!")
             return {'CANCELLED'}
 
-        if armature in tagged_bones:
-            for bone in armature.pose.bones:
-                bone.bone.select = bone.name in tagged_bones[armature]
+        armature.data.bones.foreach_set("select", _tag_mask(armature))
+        # foreach_set skips the Bone.select update, so flag the change ourselves
+        armature.data.update_tag()
+        if context.area:
+            context.area.tag_redraw()
+        if DEBUG:
             print(f"Showing only tagged bones for {armature.name}")  # Tag party!
 
         return {'FINISHED'}
@@ -118,10 +250,20 @@ class CLAYMAGNET_OT_switch_pose_mode(bpy.types.Operator):
             self.report({'ERROR'}, "Select some armatures first!")
             return {'CANCELLED'}
 
+        # Entering Pose Mode from one armature takes every selected armature still in
+        # Object Mode along (multi-object pose mode), so usually only the first call
+        # does anything. Whatever it didn't catch gets its own call.
+        active = context.object
         for armature in armatures:
-            bpy.context.view_layer.objects.active = armature
-            bpy.ops.object.mode_set(mode='POSE')
-            print(f"Flipped {armature.name} to Pose Mode")  # Pose time!
+            if armature.mode != 'POSE':
+                context.view_layer.objects.active = armature
+                bpy.ops.object.mode_set(mode='POSE')
+        if active in armatures:
+            context.view_layer.objects.active = active
+
+        if DEBUG:
+            for armature in armatures:
+                print(f"Flipped {armature.name} to Pose Mode")  # Pose time!
 
         return {'FINISHED'}
 
@@ -137,58 +279,85 @@ class CLAYMAGNET_OT_select_transform(bpy.types.Operator):
         return context.object and context.object.type == 'ARMATURE' and context.object.mode == 'POSE'
 
     def invoke(self, context, event):
+        # Nothing tagged on this rig? Let Blender's own F have the key
+        armature = context.object
+        mask = _tag_mask(armature)
+        if not mask.any():
+            return {'PASS_THROUGH'}
+        names = tuple(b.name for b, tagged in zip(armature.data.bones, mask) if tagged)
+
         # Snag the mouse spot
-        mouse_pos = mathutils.Vector((event.mouse_region_x, event.mouse_region_y))
+        mouse_x, mouse_y = float(event.mouse_region_x), float(event.mouse_region_y)
         region = context.region
         rv3d = context.region_data
 
         # Find the closest tagged bone
-        armature = context.object
         closest_bone = None
-        closest_dist = float('inf')
         hitbox_size = context.preferences.addons[__name__].preferences.hitbox_size
-
-        if armature in tagged_bones:
-            for bone_name in tagged_bones[armature]:
-                try:
-                    bone = armature.pose.bones[bone_name]
-                    bone_center = bone.head
-
-                    # Try custom shape center if it exists
-                    if bone.custom_shape:
-                        try:
-                            mesh = bone.custom_shape
-                            verts = [armature.matrix_world @ mesh.matrix_world @ v.co for v in mesh.data.vertices]
-                            if verts:
-                                bone_center = sum(verts, mathutils.Vector()) / len(verts)
-                                print(f"Got {bone_name} custom shape at {bone_center}")  # Custom shape win!
-                        except Exception as e:
-                            print(f"Whoops, {bone_name}'s custom shape messed up: {e}")  # Shape fail
-
-                    # Project bone to screen
-                    screen_pos = bpy_extras.view3d_utils.location_3d_to_region_2d(region, rv3d, bone_center)
-                    if screen_pos:
-                        dist = (mouse_pos - screen_pos).length
-                        if dist < hitbox_size and dist < closest_dist:
-                            closest_dist = dist
-                            closest_bone = bone
-                except Exception as e:
-                    print(f"Oops, skipped {bone_name}: {e}")  # Bone glitch
+        hitbox_sq = hitbox_size * hitbox_size  # Compare squared distances, no sqrt needed
+
+        pose_bones = armature.pose.bones
+        view_key = (
+            tuple(map(tuple, rv3d.perspective_matrix)),
+            region.width,
+            region.height,
+            context.scene.frame_current,
+        )
+
+        last = _last_screen_pos.get(armature.as_pointer())
+        if last is not None and last[0] == view_key and last[1] == names:
+            # Same view and tags, and nothing moved since (that clears the cache), reuse as-is
+            screen_pos, visible = last[2], last[3]
+        else:
+            screen_pos = np.zeros((len(names), 2), dtype=np.float32)
+            visible = np.zeros(len(names), dtype=bool)
+            indices = []
+            centers = []
+            for i, bone_name in enumerate(names):
+                bone = pose_bones.get(bone_name)
+                if bone is None:
+                    if DEBUG:
+                        print(f"Oops, skipped {bone_name}: not in {armature.name}")  # Bone glitch
+                    continue
+                bone_center = bone.head
+
+                mesh = bone.custom_shape
+                if mesh is not None and bone.custom_shape_transform is not None:
+                    # Shape is drawn at the override bone, its head is center enough
+                    bone_center = bone.custom_shape_transform.head
+                elif mesh is not None and mesh.type == 'MESH' and len(mesh.data.vertices):
+                    # Use the custom shape center if it's a mesh with actual vertices
+                    bone_center = armature.matrix_world @ mesh.matrix_world @ _custom_shape_centroid(mesh)
+                    if DEBUG:
+                        print(f"Got {bone_name} custom shape at {bone_center}")  # Custom shape win!
+
+                indices.append(i)
+                centers.append(bone_center)
+
+            # Project every bone to screen at once
+            if indices:
+                screen_pos[indices], visible[indices] = _project_to_region(region, rv3d, centers)
+            _last_screen_pos[armature.as_pointer()] = (view_key, names, screen_pos, visible)
+
+        closest = _closest_hit(screen_pos, visible, mouse_x, mouse_y, hitbox_sq)
+        if closest >= 0:
+            closest_bone = pose_bones[names[closest]]
 
         if closest_bone:
             bone = closest_bone
-            bone.bone.select = True
             # Shift+F adds to selection, F selects and maybe transforms
             if not event.shift:
-                for other_bone in armature.pose.bones:
-                    if other_bone != bone:
-                        other_bone.bone.select = False
+                armature.data.bones.foreach_set("select", np.zeros(len(armature.data.bones), dtype=bool))
+                bone.bone.select = True
                 # Transform only if Gizmo User is off
                 gizmo_user = context.scene.clay_magnet_gizmo_user
                 if not gizmo_user:
                     context.view_layer.objects.active = armature
                     bpy.ops.transform.translate('INVOKE_DEFAULT')
-            print(f"Picked {bone.name} with {'Shift+' if event.shift else ''}F")  # Bone grabbed!
+            else:
+                bone.bone.select = True
+            if DEBUG:
+                print(f"Picked {bone.name} with {'Shift+' if event.shift else ''}F")  # Bone grabbed!
 
         return {'FINISHED'}
 
@@ -210,16 +379,18 @@ class CLAYMAGNET_PT_panel(bpy.types.Panel):
 
     def draw(self, context):
         layout = self.layout
-        # Took ages to get multi-armature right!
-        armatures = [obj for obj in context.selected_objects if obj.type == 'ARMATURE']
-
-        if not armatures:
+        obj = context.object
+        # Took ages to get multi-armature right! Active armature is the common case,
+        # only scan the selection when it's something else
+        if (obj is None or obj.type != 'ARMATURE') and not any(
+            o.type == 'ARMATURE' for o in context.selected_objects
+        ):
             layout.label(text="Select an armature!", icon='ERROR')
             return
 
         layout.operator("clay_magnet.switch_pose_mode", icon='POSE_HLT')
 
-        if context.object and context.object.mode == 'POSE':
+        if obj and obj.mode == 'POSE':
             box = layout.box()
             box.label(text="Tagging", icon='BOOKMARKS')
             box.operator("clay_magnet.tag_bone", icon='ADD')
@@ -230,7 +401,7 @@ class CLAYMAGNET_PT_panel(bpy.types.Panel):
             box.label(text="Options", icon='SETTINGS')
             box.prop(context.scene, "clay_magnet_gizmo_user", text="Gizmo User")
 
-# Gizmo User property
+# Gizmo User and bone tag properties
 def register_properties():
     bpy.types.Scene.clay_magnet_gizmo_user = bpy.props.BoolProperty(
         name="Gizmo User",
@@ -238,66 +409,79 @@ def register_properties():
         default=False,
     )
 
+    bpy.types.Bone.clay_magnet_tag = bpy.props.BoolProperty(
+        name="Clay Magnet Tag",
+        description="Bone can be grabbed with F/Shift+F",
+        default=False,
+    )
+
 def unregister_properties():
     del bpy.types.Scene.clay_magnet_gizmo_user
-
-# Keymap setup
-keymaps = []
+    del bpy.types.Bone.clay_magnet_tag
+
+# Everything we hand to Blender, in registration order
+_CLASSES = (
+    CLAYMAGNET_Preferences,
+    CLAYMAGNET_OT_tag_bone,
+    CLAYMAGNET_OT_untag_bone,
+    CLAYMAGNET_OT_find_tagged,
+    CLAYMAGNET_OT_switch_pose_mode,
+    CLAYMAGNET_OT_select_transform,
+    CLAYMAGNET_PT_panel,
+)
+register_classes, unregister_classes = bpy.utils.register_classes_factory(_CLASSES)
+
+# Keymap setup, (keymap, item) pairs filled in by register()
+keymaps = ()
 
 def register():
+    global keymaps
+
     # Register classes and properties
-    for cls in [
-        CLAYMAGNET_Preferences,
-        CLAYMAGNET_OT_tag_bone,
-        CLAYMAGNET_OT_untag_bone,
-        CLAYMAGNET_OT_find_tagged,
-        CLAYMAGNET_OT_switch_pose_mode,
-        CLAYMAGNET_OT_select_transform,
-        CLAYMAGNET_PT_panel,
-    ]:
-        bpy.utils.register_class(cls)
+    register_classes()
 
     register_properties()
+    bpy.app.handlers.depsgraph_update_post.append(_on_depsgraph_update)
+    for handlers in _RELOAD_HANDLERS:
+        handlers.append(_on_data_reload)
 
     # Set up keymap for F and Shift+F
     wm = bpy.context.window_manager
     km = wm.keyconfigs.addon.keymaps.new(name='Pose', space_type='EMPTY')
-    kmi = km.keymap_items.new(
-        CLAYMAGNET_OT_select_transform.bl_idname,
-        'F',
-        'PRESS',
-        shift=False,
-    )
-    keymaps.append((km, kmi))
-    kmi = km.keymap_items.new(
-        CLAYMAGNET_OT_select_transform.bl_idname,
-        'F',
-        'PRESS',
-        shift=True,
+    keymaps = tuple(
+        (km, km.keymap_items.new(
+            CLAYMAGNET_OT_select_transform.bl_idname,
+            'F',
+            'PRESS',
+            shift=shift,
+        ))
+        for shift in (False, True)
     )
-    keymaps.append((km, kmi))
-    print("Clay Magnet ready to roll!")  # Addon’s alive!
+    if DEBUG:
+        print("Clay Magnet ready to roll!")  # Addon’s alive!
 
 def unregister():
+    global keymaps
+
     # Clean up keymap
     for km, kmi in keymaps:
         km.keymap_items.remove(kmi)
-    keymaps.clear()
+    keymaps = ()
+
+    if _on_depsgraph_update in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(_on_depsgraph_update)
+    for handlers in _RELOAD_HANDLERS:
+        if _on_data_reload in handlers:
+            handlers.remove(_on_data_reload)
+    _custom_shape_centroid_cache.clear()
+    _last_screen_pos.clear()
 
     # Unregister classes and properties
-    for cls in reversed([
-        CLAYMAGNET_Preferences,
-        CLAYMAGNET_OT_tag_bone,
-        CLAYMAGNET_OT_untag_bone,
-        CLAYMAGNET_OT_find_tagged,
-        CLAYMAGNET_OT_switch_pose_mode,
-        CLAYMAGNET_OT_select_transform,
-        CLAYMAGNET_PT_panel,
-    ]):
-        bpy.utils.unregister_class(cls)
+    unregister_classes()
 
     unregister_properties()
-    print("Clay Magnet signing off!")  # Peace out
+    if DEBUG:
+        print("Clay Magnet signing off!")  # Peace out
 
 if __name__ == "__main__":
     register()
\ No newline at end of file